@@ -1,6 +1,6 @@
 """
 chess_game.py
-Simple GUI chess: local 1v1 (pass-and-play) + play vs AI (minimax w/ alpha-beta using python-chess).
+Simple GUI chess: local 1v1 (pass-and-play) + play vs AI (negamax w/ alpha-beta using python-chess).
 
 Requirements:
     pip install pygame python-chess
@@ -10,15 +10,20 @@ Run:
 
 Controls:
  - Click a piece to select it, click a square to move.
- - Buttons: New Game, Undo, Toggle AI (AI plays Black), AI Depth (- / +)
+ - Buttons: New Game, Undo, Toggle AI (AI plays Black), AI Time per move (- / +)
  - Promotion auto-queens (simple).
+ - If a polyglot opening book is placed next to this file as book.bin, the AI plays from it while in book.
 """
 
+import os
+import multiprocessing
 import pygame
+import queue
 import sys
 import threading
 import time
 import chess
+import chess.polyglot
 
 # ---------- Config ----------
 WIDTH, HEIGHT = 640, 640
@@ -26,6 +31,12 @@ SQUARE = WIDTH // 8
 PANEL_WIDTH = 220
 FPS = 30
 AI_THINK_DELAY = 0.15
+BOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin")  # optional polyglot book
+AI_TIME_BUDGET = 5.0   # default seconds per AI move; the search is aborted when it runs out
+AI_MAX_DEPTH = 64      # iterative deepening stops here even with time left
+AI_WORKERS = min((os.cpu_count() or 1) - 1, 4)   # root-split processes; one core is left for the GUI
+PARALLEL_MIN_WORKERS = 3   # with fewer, the split's extra work eats most of the gain
+PARALLEL_MIN_DEPTH = 3     # shallower iterations are cheaper to search in-process
 
 # Colors
 LIGHT = (240, 217, 181)
@@ -44,49 +55,279 @@ PIECE_VALUES = {
     chess.KING: 20000
 }
 
+# Transposition table: position key -> (depth, value, flag, best_move)
+TT = {}
+tt_generation = 0   # bumped when TT is cleared so root workers clear theirs too
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Id of the current AI search. Bumping it cancels the running search and marks
+# its result stale; shared memory so forked root workers see it too.
+SEARCH_ID = multiprocessing.Value("i", 0)
+search_id = None          # id/deadline of the search running in this process
+search_deadline = None    # (None: not cancellable)
+nodes = 0
+
+class AbortSearch(Exception):
+    pass
+
+def new_search_id() -> int:
+    with SEARCH_ID.get_lock():
+        SEARCH_ID.value += 1
+        return SEARCH_ID.value
+
+def count_node():
+    # polling on every node would cost more than it saves
+    global nodes
+    nodes += 1
+    if nodes & 1023 == 0 and search_id is not None:
+        if SEARCH_ID.value != search_id or time.time() >= search_deadline:
+            raise AbortSearch
+
+# Frontier (depth 1) futility pruning: a quiet move is assumed to change the
+# static eval by at most this much
+FUTILITY_MARGIN = 300
+
 def evaluate(board: chess.Board) -> int:
-    if board.is_checkmate():
-        # if side to move is checkmated it's bad for them
-        return -999999 if board.turn else 999999
-    if board.is_stalemate() or board.is_insufficient_material():
+    if board.is_insufficient_material():
+        return 0
+    # one early-exit probe instead of separate checkmate/stalemate scans
+    if not any(board.generate_legal_moves()):
+        if board.is_check():
+            # if side to move is checkmated it's bad for them
+            return -999999 if board.turn else 999999
         return 0
     score = 0
     for ptype, val in PIECE_VALUES.items():
-        score += val * (len(board.pieces(ptype, chess.WHITE)) - len(board.pieces(ptype, chess.BLACK)))
-    # mobility
-    score += 5 * (len(list(board.legal_moves)) if board.turn else -len(list(board.legal_moves)))
+        score += val * (chess.popcount(board.pieces_mask(ptype, chess.WHITE))
+                        - chess.popcount(board.pieces_mask(ptype, chess.BLACK)))
+    # mobility (pseudo-attacks, no legal move generation)
+    score += 5 * (mobility(board, chess.WHITE) - mobility(board, chess.BLACK))
     return score
 
-def minimax(board: chess.Board, depth: int, alpha: int, beta: int, maximizing: bool):
-    if depth == 0 or board.is_game_over():
-        return evaluate(board), None
+def mobility(board: chess.Board, color: chess.Color) -> int:
+    # hot path: bind lookups to locals once per call instead of once per square
+    own = board.occupied_co[color]
+    not_own = ~own
+    attacks_mask = board.attacks_mask
+    popcount = chess.popcount
+    return sum([popcount(attacks_mask(sq) & not_own) for sq in chess.scan_reversed(own)])
+
+def mvv_lva(board: chess.Board, mv: chess.Move) -> int:
+    # most valuable victim first, cheapest attacker breaks ties
+    return material_gain(board, mv) * 10 - PIECE_VALUES[board.piece_type_at(mv.from_square)]
+
+def noisy_moves(board: chess.Board):
+    # captures (incl. capture-promotions) and quiet promotions, MVV-LVA ordered
+    promo_rank = chess.BB_RANK_7 if board.turn else chess.BB_RANK_2
+    moves = list(board.generate_legal_captures())
+    moves.extend(board.generate_legal_moves(board.pawns & board.occupied_co[board.turn] & promo_rank,
+                                            ~board.occupied))
+    moves.sort(key=lambda mv: mvv_lva(board, mv), reverse=True)
+    return moves
+
+def ordered_moves(board: chess.Board, first=None):
+    # the given move (e.g. from the TT), then captures/promotions, then quiet moves
+    if first is not None and board.is_legal(first):
+        yield first
+    for mv in noisy_moves(board):
+        if mv != first:
+            yield mv
+    for mv in board.generate_legal_moves(chess.BB_ALL, ~board.occupied_co[not board.turn]):
+        if mv != first and not mv.promotion and not board.is_en_passant(mv):
+            yield mv
+
+def material_gain(board: chess.Board, mv: chess.Move) -> int:
+    if board.is_en_passant(mv):
+        gain = PIECE_VALUES[chess.PAWN]
+    else:
+        victim = board.piece_type_at(mv.to_square)
+        gain = PIECE_VALUES[victim] if victim else 0
+    if mv.promotion:
+        gain += PIECE_VALUES[mv.promotion] - PIECE_VALUES[chess.PAWN]
+    return gain
+
+def losing_capture(board: chess.Board, mv: chess.Move) -> bool:
+    # cheap stand-in for SEE: a bigger piece taking a smaller, defended one
+    attacker = PIECE_VALUES[board.piece_type_at(mv.from_square)]
+    return attacker > material_gain(board, mv) and board.is_attacked_by(not board.turn, mv.to_square)
+
+def gives_direct_check(board: chess.Board, mv: chess.Move) -> bool:
+    # attack tables only (board.gives_check pushes/pops); misses discovered checks
+    king = board.king(not board.turn)
+    if king is None:
+        return False
+    ptype = board.piece_type_at(mv.from_square)
+    to = mv.to_square
+    occ = board.occupied & ~chess.BB_SQUARES[mv.from_square]
+    if ptype == chess.PAWN:
+        mask = chess.BB_PAWN_ATTACKS[board.turn][to]
+    elif ptype == chess.KNIGHT:
+        mask = chess.BB_KNIGHT_ATTACKS[to]
+    else:
+        mask = 0
+        if ptype in (chess.BISHOP, chess.QUEEN):
+            mask |= chess.BB_DIAG_ATTACKS[to][chess.BB_DIAG_MASKS[to] & occ]
+        if ptype in (chess.ROOK, chess.QUEEN):
+            mask |= (chess.BB_RANK_ATTACKS[to][chess.BB_RANK_MASKS[to] & occ]
+                     | chess.BB_FILE_ATTACKS[to][chess.BB_FILE_MASKS[to] & occ])
+    return bool(mask & chess.BB_SQUARES[king])
+
+def quiet_move(board: chess.Board, mv: chess.Move) -> bool:
+    return not (mv.promotion or board.is_capture(mv) or gives_direct_check(board, mv))
+
+def side_sign(board: chess.Board) -> int:
+    # evaluate() scores from White's POV; negamax wants the side to move's
+    return 1 if board.turn == chess.WHITE else -1
+
+def qsearch(board: chess.Board, alpha: int, beta: int) -> int:
+    # only expand captures/promotions until the position is quiet
+    count_node()
+    stand_pat = side_sign(board) * evaluate(board)
+    if stand_pat >= beta:
+        return stand_pat
+    alpha = max(alpha, stand_pat)
+    best = stand_pat
+    for mv in noisy_moves(board):
+        # delta pruning: even winning this piece can't raise alpha
+        if stand_pat + material_gain(board, mv) + 200 < alpha:
+            continue
+        if losing_capture(board, mv):
+            continue
+        board.push(mv)
+        val = -qsearch(board, -beta, -alpha)
+        board.pop()
+        best = max(best, val)
+        alpha = max(alpha, val)
+        if alpha >= beta:
+            break
+    return best
+
+def negamax(board: chess.Board, depth: int, alpha: int, beta: int):
+    # scores are from the side to move's point of view
+    count_node()
+    if board.is_game_over():
+        return side_sign(board) * evaluate(board), None
+    if depth == 0:
+        return qsearch(board, alpha, beta), None
+    key = board._transposition_key()
+    entry = TT.get(key)
+    tt_move = None
+    if entry is not None:
+        e_depth, e_val, e_flag, tt_move = entry
+        if e_depth >= depth:
+            if e_flag == EXACT:
+                return e_val, tt_move
+            if e_flag == LOWER:
+                alpha = max(alpha, e_val)
+            elif e_flag == UPPER:
+                beta = min(beta, e_val)
+            if alpha >= beta:
+                return e_val, tt_move
+    # bound flags are relative to the window actually searched
+    alpha_orig, beta_orig = alpha, beta
+    # at the frontier, score quiet moves by static eval instead of searching them
+    # when even eval + margin can't reach the window
+    static = side_sign(board) * evaluate(board) if depth == 1 and not board.is_check() else None
+    best_eval = -10**9
     best_move = None
-    if maximizing:
-        max_eval = -10**9
-        for mv in board.legal_moves:
+    for mv in ordered_moves(board, tt_move):
+        if static is not None and static + FUTILITY_MARGIN <= alpha and quiet_move(board, mv):
+            val = static + FUTILITY_MARGIN
+        else:
             board.push(mv)
-            val, _ = minimax(board, depth-1, alpha, beta, False)
+            val = -negamax(board, depth-1, -beta, -alpha)[0]
             board.pop()
-            if val > max_eval:
-                max_eval = val
-                best_move = mv
-            alpha = max(alpha, val)
-            if beta <= alpha:
-                break
-        return max_eval, best_move
+        if val > best_eval:
+            best_eval = val
+            best_move = mv
+        alpha = max(alpha, val)
+        if alpha >= beta:
+            break
+    if best_eval <= alpha_orig:
+        flag = UPPER
+    elif best_eval >= beta_orig:
+        flag = LOWER
     else:
-        min_eval = 10**9
-        for mv in board.legal_moves:
-            board.push(mv)
-            val, _ = minimax(board, depth-1, alpha, beta, True)
-            board.pop()
-            if val < min_eval:
-                min_eval = val
-                best_move = mv
-            beta = min(beta, val)
-            if beta <= alpha:
-                break
-        return min_eval, best_move
+        flag = EXACT
+    TT[key] = (depth, best_eval, flag, best_move)
+    return best_eval, best_move
+
+def search_root_moves(board: chess.Board, moves, depth: int, sid: int, deadline: float, generation: int):
+    # runs in a worker process: search one slice of the root moves on a private board
+    global search_id, search_deadline, tt_generation
+    search_id, search_deadline = sid, deadline
+    if generation != tt_generation:
+        TT.clear()
+        tt_generation = generation
+    # only moves that beat the shared alpha get an exact score worth reporting
+    best_eval = -10**9
+    best_move = None
+    for mv in moves:
+        alpha = ROOT_ALPHA.value
+        board.push(mv)
+        val = -negamax(board, depth-1, -10**9, -alpha)[0]
+        board.pop()
+        if val > alpha:
+            with ROOT_ALPHA.get_lock():
+                ROOT_ALPHA.value = max(ROOT_ALPHA.value, val)
+            if val > best_eval:
+                best_eval, best_move = val, mv
+    return best_eval, best_move
+
+# Best root score so far in a parallel search; root workers read it as alpha
+ROOT_ALPHA = multiprocessing.Value("i", -10**9)
+
+def make_root_pools():
+    # one single-process pool per worker, so a root move can go to the same
+    # process (and TT) on every iteration. Forked here, at import, so workers
+    # start from a single-threaded process without SDL and don't re-run the
+    # pygame setup below. Only on Linux: fork isn't safe once macOS frameworks
+    # are loaded.
+    if AI_WORKERS >= PARALLEL_MIN_WORKERS and sys.platform.startswith("linux"):
+        ctx = multiprocessing.get_context("fork")
+        return [ctx.Pool(1) for _ in range(AI_WORKERS)]
+    return []
+
+ROOT_POOLS = make_root_pools()
+
+def parallel_negamax(board: chess.Board, depth: int):
+    key = board._transposition_key()
+    entry = TT.get(key)
+    moves = list(ordered_moves(board, entry[3] if entry else None))
+    if not ROOT_POOLS or depth < PARALLEL_MIN_DEPTH or len(moves) <= len(ROOT_POOLS):
+        return negamax(board, depth, -10**9, 10**9)
+    # search the expected best move here first, so the workers start with a real alpha
+    first = moves[0]
+    board.push(first)
+    best_eval = -negamax(board, depth-1, -10**9, 10**9)[0]
+    board.pop()
+    best_move = first
+    ROOT_ALPHA.value = best_eval
+    # each root move always goes to the same worker, whose TT still holds its
+    # subtree from the previous iteration
+    owner = {mv: i % len(ROOT_POOLS) for i, mv in enumerate(board.legal_moves)}
+    slices = [[] for _ in ROOT_POOLS]
+    for mv in moves[1:]:
+        slices[owner[mv]].append(mv)
+    snap = board.copy(stack=False)
+    args = (depth, search_id, search_deadline, tt_generation)
+    results = [pool.apply_async(search_root_moves, (snap, sl) + args)
+               for pool, sl in zip(ROOT_POOLS, slices) if sl]
+    # wait for every slice, so no worker is still busy when the next search starts
+    aborted = False
+    for r in results:
+        try:
+            val, mv = r.get()
+        except AbortSearch:
+            aborted = True
+            continue
+        if mv is not None and val > best_eval:
+            best_eval, best_move = val, mv
+    if aborted:
+        raise AbortSearch
+    # the first move had a full window and the rest beat its score, so this is exact
+    TT[key] = (depth, best_eval, EXACT, best_move)
+    return best_eval, best_move
 
 # ---------- Pygame setup ----------
 pygame.init()
@@ -114,14 +355,51 @@ UNICODE_PIECES_BLACK = {
     chess.KING:   "♚"
 }
 
+# Static board squares, drawn once
+BOARD_BG = pygame.Surface((WIDTH, HEIGHT))
+for r in range(8):
+    for f in range(8):
+        rect = pygame.Rect(f*SQUARE, r*SQUARE, SQUARE, SQUARE)
+        color = LIGHT if (r + f) % 2 == 0 else DARK
+        pygame.draw.rect(BOARD_BG, color, rect)
+
+# Static panel: background plus the labels that never change
+PANEL_BG_SURF = pygame.Surface((PANEL_WIDTH, HEIGHT))
+PANEL_BG_SURF.fill(PANEL_BG)
+for text, pos, color in [
+    ("New Game", (20, 18), TEXT),
+    ("Undo", (20, 58), TEXT),
+    ("Toggle AI", (20, 128), TEXT),
+    ("AI Time:", (20, 168), TEXT),
+    ("Time -", (20, 200), TEXT),
+    ("Time +", (120, 200), TEXT),
+    ("Status:", (20, 250), TEXT),
+    ("Click: select -> move", (20, 320), (200,200,200)),
+]:
+    PANEL_BG_SURF.blit(font.render(text, True, color), pos)
+
+# Pre-rendered piece glyphs and their circle backgrounds (drawn once, blitted every frame)
+PIECE_SURFACES = {}
+for ptype, text in UNICODE_PIECES.items():
+    PIECE_SURFACES[(chess.WHITE, ptype)] = bigfont.render(text, True, (0,0,0))
+for ptype, text in UNICODE_PIECES_BLACK.items():
+    PIECE_SURFACES[(chess.BLACK, ptype)] = bigfont.render(text, True, (0,0,0))
+BG_SURFACES = {}
+for color, fill in ((chess.WHITE, (220,220,220)), (chess.BLACK, (120,120,120))):
+    surf = pygame.Surface((SQUARE, SQUARE), pygame.SRCALPHA)
+    # draw a circle bg to make piece visible
+    pygame.draw.circle(surf, fill, (SQUARE//2, SQUARE//2), SQUARE//2 - 8)
+    BG_SURFACES[color] = surf
+
 # Game state
 board = chess.Board()
 selected = None
 highlight_squares = []
 move_history = []
 ai_enabled = False   # when True: AI plays Black
-ai_depth = 2
+ai_time = AI_TIME_BUDGET   # seconds per AI move
 ai_thinking = False
+RESULT_Q = queue.Queue()   # (search id, move) posted by the AI thread
 
 def coord_to_square(pos):
     x, y = pos
@@ -140,11 +418,7 @@ def square_to_coord(sq):
 
 def draw_board():
     # draw squares
-    for r in range(8):
-        for f in range(8):
-            rect = pygame.Rect(f*SQUARE, r*SQUARE, SQUARE, SQUARE)
-            color = LIGHT if (r + f) % 2 == 0 else DARK
-            pygame.draw.rect(screen, color, rect)
+    screen.blit(BOARD_BG, (0, 0))
     # highlights
     for sq in highlight_squares:
         x, y = square_to_coord(sq)
@@ -156,30 +430,17 @@ def draw_board():
         p = board.piece_at(sq)
         if p:
             x, y = square_to_coord(sq)
-            # draw a circle bg to make piece visible
-            pygame.draw.circle(screen, (120,120,120) if p.color==chess.BLACK else (220,220,220),
-                               (x + SQUARE//2, y + SQUARE//2), SQUARE//2 - 8)
-            if p.color == chess.WHITE:
-                text = UNICODE_PIECES[p.piece_type]
-            else:
-                text = UNICODE_PIECES_BLACK[p.piece_type]
-            txt = bigfont.render(text, True, (0,0,0))
+            screen.blit(BG_SURFACES[p.color], (x, y))
+            txt = PIECE_SURFACES[(p.color, p.piece_type)]
             rect = txt.get_rect(center=(x + SQUARE//2, y + SQUARE//2 + 2))
             screen.blit(txt, rect)
 
 def draw_panel():
-    panel_rect = pygame.Rect(WIDTH, 0, PANEL_WIDTH, HEIGHT)
-    pygame.draw.rect(screen, PANEL_BG, panel_rect)
-    # Buttons text (simple)
+    screen.blit(PANEL_BG_SURF, (WIDTH, 0))
+    # dynamic text (static labels are baked into PANEL_BG_SURF)
     lines = [
-        ("New Game", (WIDTH + 20, 18)),
-        ("Undo", (WIDTH + 20, 58)),
         (f"AI: {'On' if ai_enabled else 'Off'}", (WIDTH + 20, 98)),
-        ("Toggle AI", (WIDTH + 20, 128)),
-        ("AI Depth:", (WIDTH + 20, 168)),
-        (str(ai_depth), (WIDTH + 140, 168)),
-        ("Depth -", (WIDTH + 20, 200)),
-        ("Depth +", (WIDTH + 120, 200)),
+        (f"{ai_time:g}s", (WIDTH + 140, 168)),
     ]
     for text, pos in lines:
         screen.blit(font.render(text, True, TEXT), pos)
@@ -191,10 +452,7 @@ def draw_panel():
         status = "Checkmate! " + ("Black wins" if board.turn else "White wins")
     if board.is_stalemate():
         status = "Stalemate!"
-    screen.blit(font.render("Status:", True, TEXT), (WIDTH + 20, 250))
     screen.blit(font.render(status, True, TEXT), (WIDTH + 20, 270))
-    # instruction
-    screen.blit(font.render("Click: select -> move", True, (200,200,200)), (WIDTH + 20, 320))
     if ai_thinking:
         screen.blit(font.render("AI thinking...", True, (255,200,0)), (WIDTH + 20, 350))
 
@@ -204,8 +462,8 @@ def button_at_pos(pos):
         "new": pygame.Rect(WIDTH+20, 12, 160, 28),
         "undo": pygame.Rect(WIDTH+20, 52, 80, 28),
         "toggle": pygame.Rect(WIDTH+20, 124, 120, 28),
-        "depth_minus": pygame.Rect(WIDTH+20, 196, 80, 28),
-        "depth_plus": pygame.Rect(WIDTH+120, 196, 80, 28),
+        "time_minus": pygame.Rect(WIDTH+20, 196, 80, 28),
+        "time_plus": pygame.Rect(WIDTH+120, 196, 80, 28),
     }
     for name, rect in mapping.items():
         if rect.collidepoint(x, y):
@@ -214,44 +472,87 @@ def button_at_pos(pos):
 
 def attempt_move(from_sq, to_sq):
     # supports auto-queen on promotion
-    mv = chess.Move(from_sq, to_sq)
-    if mv in board.legal_moves:
+    if board.piece_type_at(from_sq) == chess.PAWN and chess.square_rank(to_sq) in (0, 7):
+        mv = chess.Move(from_sq, to_sq, promotion=chess.QUEEN)
+    else:
+        mv = chess.Move(from_sq, to_sq)
+    if board.is_legal(mv):
         board.push(mv)
         move_history.append(mv)
         return True
-    # try promotion to queen
-    promo = chess.Move(from_sq, to_sq, promotion=chess.QUEEN)
-    if promo in board.legal_moves:
-        board.push(promo)
-        move_history.append(promo)
-        return True
     return False
 
-def ai_worker(depth):
-    global ai_thinking
-    ai_thinking = True
+def book_move(board):
+    # weighted random move from the opening book, or None if no book / out of book
+    try:
+        with chess.polyglot.open_reader(BOOK_PATH) as reader:
+            return reader.weighted_choice(board).move
+    except (OSError, IndexError):
+        return None
+
+def ai_worker(snap, budget, sid):
+    # searches a private copy of the board; the main thread applies the result
+    global search_id, search_deadline
     time.sleep(AI_THINK_DELAY)
     # AI plays Black in this simple setup (human is White)
-    maximizing = False  # since from eval's POV, maximizing True == White
-    _, best = minimax(board, depth, -10**9, 10**9, maximizing)
-    if best is not None:
-        board.push(best)
-        move_history.append(best)
-    ai_thinking = False
+    best = book_move(snap)
+    if best is None:
+        # iterative deepening until the budget runs out: each completed pass leaves
+        # its best move in the TT, which the next (deeper) pass tries first
+        search_id, search_deadline = sid, time.time() + budget
+        try:
+            for d in range(1, AI_MAX_DEPTH + 1):
+                score, mv = parallel_negamax(snap, d)
+                if mv is not None:
+                    best = mv
+                if abs(score) >= 999999:
+                    # forced mate found; searching deeper won't change the move
+                    break
+        except AbortSearch:
+            # keep the move from the last completed depth
+            pass
+        if best is None:
+            # out of time before even depth 1 finished
+            while snap.move_stack:
+                snap.pop()
+            best = next(iter(snap.legal_moves), None)
+    RESULT_Q.put((sid, best))
 
 def start_ai_if_needed():
+    global ai_thinking
     # If AI enabled and it's black's turn and not thinking and game not over -> start AI
     if ai_enabled and (not board.turn) and (not ai_thinking) and (not board.is_game_over()):
-        t = threading.Thread(target=ai_worker, args=(ai_depth,), daemon=True)
+        ai_thinking = True
+        snap = board.copy(stack=False)
+        t = threading.Thread(target=ai_worker, args=(snap, ai_time, new_search_id()), daemon=True)
         t.start()
 
+def apply_ai_results():
+    global ai_thinking
+    while True:
+        try:
+            sid, best = RESULT_Q.get_nowait()
+        except queue.Empty:
+            return
+        # the search is finished either way; only play its move if the
+        # position it was started on is still the current one
+        ai_thinking = False
+        if sid != SEARCH_ID.value:
+            continue
+        if best is not None and board.is_legal(best):
+            board.push(best)
+            move_history.append(best)
+
 def reset_game():
-    global board, selected, highlight_squares, move_history, ai_thinking
+    global board, selected, highlight_squares, move_history, tt_generation
     board = chess.Board()
     selected = None
     highlight_squares = []
     move_history = []
-    ai_thinking = False
+    # a running search keeps ai_thinking set until it posts its (now stale) result
+    new_search_id()
+    TT.clear()
+    tt_generation += 1
 
 def undo():
     global move_history
@@ -262,16 +563,25 @@ def undo():
     if ai_enabled and len(move_history) >= 1:
         board.pop()
         move_history.pop()
+    # drop any search that was running on the old position
+    new_search_id()
 
 def main():
-    global selected, highlight_squares, ai_enabled, ai_depth
+    global selected, highlight_squares, ai_enabled, ai_time
     running = True
+    dirty = True
+    # the AI thread changes these behind our back; redraw when they move
+    ai_state = None
     while running:
         for ev in pygame.event.get():
             if ev.type == pygame.QUIT:
                 running = False
                 break
+            if ev.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                dirty = True
             if ev.type == pygame.MOUSEBUTTONDOWN and ev.button == 1:
+                # any click can change selection, board or settings
+                dirty = True
                 pos = pygame.mouse.get_pos()
                 # Board click?
                 if pos[0] < WIDTH:
@@ -284,7 +594,7 @@ def main():
                         if piece is not None and piece.color == board.turn:
                             selected = sq
                             # highlight legal moves from selected
-                            highlight_squares = [m.to_square for m in board.legal_moves if m.from_square == sq]
+                            highlight_squares = [m.to_square for m in board.generate_legal_moves(from_mask=chess.BB_SQUARES[sq])]
                     else:
                         # attempt move
                         if attempt_move(selected, sq):
@@ -297,7 +607,7 @@ def main():
                             p2 = board.piece_at(sq)
                             if p2 is not None and p2.color == board.turn:
                                 selected = sq
-                                highlight_squares = [m.to_square for m in board.legal_moves if m.from_square == sq]
+                                highlight_squares = [m.to_square for m in board.generate_legal_moves(from_mask=chess.BB_SQUARES[sq])]
                             else:
                                 selected = None
                                 highlight_squares = []
@@ -312,23 +622,32 @@ def main():
                         ai_enabled = not ai_enabled
                         # If toggled on and it's AI's turn, start AI
                         start_ai_if_needed()
-                    elif btn == "depth_minus":
-                        if ai_depth > 1:
-                            ai_depth -= 1
-                    elif btn == "depth_plus":
-                        if ai_depth < 4:
-                            ai_depth += 1
-
-        # if AI is enabled and it's black to move, let it start (if not already started)
+                    elif btn == "time_minus":
+                        if ai_time > 1:
+                            ai_time -= 1
+                    elif btn == "time_plus":
+                        if ai_time < 30:
+                            ai_time += 1
+
+        # pick up a finished AI move, then let the AI start if it's black to move
+        apply_ai_results()
         start_ai_if_needed()
 
-        # drawing
-        screen.fill((0,0,0))
-        draw_board()
-        draw_panel()
-        pygame.display.flip()
+        if (ai_thinking, len(board.move_stack)) != ai_state:
+            ai_state = (ai_thinking, len(board.move_stack))
+            dirty = True
+
+        # drawing (only when something changed)
+        if dirty:
+            screen.fill((0,0,0))
+            draw_board()
+            draw_panel()
+            pygame.display.flip()
+            dirty = False
         clock.tick(FPS)
 
+    for pool in ROOT_POOLS:
+        pool.terminate()
     pygame.quit()
     sys.exit()
 